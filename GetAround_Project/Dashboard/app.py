@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import plotly.express as px 
 import plotly.graph_objects as go
@@ -19,6 +20,57 @@ def load_data():
     return data
 
 
+# Server-side binning: only the bin counts are sent to the browser, not every row
+@st.cache_data
+def compute_delay_histogram(bin_size=20, max_delay=720):
+    data = load_data()
+    delays = data['delay_at_checkout_in_minutes'].to_numpy()
+    delays = delays[(delays > 0) & (delays < max_delay)]
+    counts, edges = np.histogram(delays, bins=np.arange(0, max_delay + bin_size, bin_size))
+    percents = counts / max(counts.sum(), 1) * 100
+    return percents, edges
+
+
+# Effects of a minimal delay between rentals, as percentages per checkin method
+@st.cache_data
+def compute_minimal_delay_effects(delays):
+    data = load_data()
+    thresholds = np.asarray(delays)
+    checkin_type = data['checkin_type'].to_numpy()
+    time_delta = data['time_delta_with_previous_rental_in_minutes'].to_numpy(dtype=float)
+    delay_at_checkout = data['delay_at_checkout_in_minutes'].to_numpy(dtype=float)
+
+    has_previous = ~np.isnan(time_delta)
+    problematic = delay_at_checkout > time_delta
+    total = has_previous.sum()
+    total_problematic_rentals = problematic.sum()
+
+    prct_affected = {}
+    prct_avoided = {}
+    for checkin in ['connect', 'mobile', 'total']:
+        selection = np.ones(len(data), dtype=bool) if checkin == 'total' else checkin_type == checkin
+        # Rentals affected: time delta with the previous rental strictly below the delay
+        sorted_deltas = np.sort(time_delta[selection & has_previous])
+        count_affected = np.searchsorted(sorted_deltas, thresholds, side='left')
+        prct_affected[checkin] = (count_affected / total * 100).tolist()
+        # Problematic rentals avoided: lateness beyond the time delta covered by the delay
+        sorted_overlaps = np.sort((delay_at_checkout - time_delta)[selection & problematic])
+        count_avoided = np.searchsorted(sorted_overlaps, thresholds, side='right')
+        prct_avoided[checkin] = (count_avoided / total_problematic_rentals * 100).tolist()
+
+    return prct_affected, prct_avoided
+
+
+# Payload size of each figure, only measured when enabled in the sidebar
+show_payload_sizes = st.sidebar.checkbox("Show figures payload size", value=False)
+payload_sizes = {}
+
+def plot_chart(fig, name, **kwargs):
+    if show_payload_sizes:
+        payload_sizes[name] = len(fig.to_json().encode('utf-8'))
+    st.plotly_chart(fig, **kwargs)
+
+
 # Storing data in a variable
 data = load_data()
 st.session_state["data"] = data
@@ -53,7 +105,7 @@ with col1 :
     fig.update_layout(title='Percentage of checkout delays',
                     showlegend=True)
 
-    st.plotly_chart(fig, use_container_width=True)
+    plot_chart(fig, 'Figure #1', use_container_width=True)
 
 with col2 : 
 
@@ -72,24 +124,28 @@ with col2 :
     fig.update_layout(title='Percentage of canceled rentals',
                     showlegend=True)
 
-    st.plotly_chart(fig, use_container_width=True)
+    plot_chart(fig, 'Figure #2', use_container_width=True)
 
 
 #Figure #3
-data_hist = data.loc[(data['delay_at_checkout_in_minutes'] > 0) & (data['delay_at_checkout_in_minutes'] < 720)]
-fig = px.histogram(data_hist['delay_at_checkout_in_minutes'], nbins=50, histnorm='percent', color_discrete_sequence=['#317AC1'])
+percents, edges = compute_delay_histogram()
+fig = go.Figure(data=[go.Bar(
+    x=(edges[:-1] + edges[1:]) / 2,
+    y=percents,
+    width=np.diff(edges),
+    customdata=np.column_stack((edges[:-1], edges[1:])),
+    marker_color='#317AC1',
+    name='Delay at checkout in minutes',
+    hovertemplate='Delay at checkout in minutes: %{customdata[0]:.0f} - %{customdata[1]:.0f}<br>Percentage of all delays: %{y:.2f}%<extra></extra>'
+)])
 fig.update_layout(
     xaxis_title='Minutes late at checkout',
     yaxis_title='Percentage of all delays',
-    title='Distribution of delays according to their duration in minutes')
+    title='Distribution of delays according to their duration in minutes',
+    bargap=0)
 fig.update_xaxes(
     dtick=20)
-fig.update_traces(
-    name='Delay at checkout in minutes')
-fig.update_traces(
-    hovertemplate='Delay at checkout in minutes: %{x}<br>Percentage of all delays: %{y:.2f}%<extra></extra>'
-)
-st.plotly_chart(fig, use_container_width=True)
+plot_chart(fig, 'Figure #3', use_container_width=True)
 
 st.subheader("Potential effects of adding a minimum delay between two locations")
 st.markdown("<div style='margin-left: 30px;'></div>", unsafe_allow_html=True)
@@ -107,26 +163,10 @@ with col1 :
     bar_width = 2
     opacity = 0.8
 
-    prct_connect = []
-    prct_mobile = []
-    prct_total = []
-
-    for delay in minimal_delay_between_rentals_in_minutes:
-        count_connect = len(data[(data['checkin_type'] == 'connect') & (data['time_delta_with_previous_rental_in_minutes'] < delay)])
-        count_mobile = len(data[(data['checkin_type'] == 'mobile') & (data['time_delta_with_previous_rental_in_minutes'] < delay)])
-        count_total = len(data[data['time_delta_with_previous_rental_in_minutes'] < delay])
-        
-        total_connect = len(data[data['checkin_type'] == 'connect'])
-        total_mobile = len(data[data['checkin_type'] == 'mobile'])
-        total = data['time_delta_with_previous_rental_in_minutes'].notna().sum()
-        
-        percentage_connect = (count_connect / total) * 100
-        percentage_mobile = (count_mobile / total) * 100
-        percentage_total = (count_total / total) * 100
-
-        prct_connect.append(percentage_connect)
-        prct_mobile.append(percentage_mobile)
-        prct_total.append(percentage_total)
+    prct_affected, _ = compute_minimal_delay_effects(tuple(minimal_delay_between_rentals_in_minutes))
+    prct_connect = prct_affected['connect']
+    prct_mobile = prct_affected['mobile']
+    prct_total = prct_affected['total']
 
     fig = go.Figure()
 
@@ -167,36 +207,21 @@ with col1 :
             title_font=dict(size=14))
     )
 
-    st.plotly_chart(fig, use_container_width=False)
+    plot_chart(fig, 'Figure #4', use_container_width=False)
 
 with col2 :
 
     #Figure #5
-    data_filtred = data.loc[data['delay_at_checkout_in_minutes'] > data['time_delta_with_previous_rental_in_minutes'],:]
     additional_delay_between_rentals_in_minutes = [5, 15, 30, 60, 90, 120]
     categories = ['connect', 'mobile', 'all']
 
     bar_width = 2
     opacity = 0.8
 
-    prct_connect = []
-    prct_mobile = []
-    prct_total = []
-
-    for delay in additional_delay_between_rentals_in_minutes:
-        count_connect = len(data_filtred[(data_filtred['checkin_type'] == 'connect') & (data_filtred['delay_at_checkout_in_minutes'] <= data_filtred['time_delta_with_previous_rental_in_minutes'] + delay)])
-        count_mobile = len(data_filtred[(data_filtred['checkin_type'] == 'mobile') & (data_filtred['delay_at_checkout_in_minutes'] <= data_filtred['time_delta_with_previous_rental_in_minutes'] + delay)])
-        count_total = len(data_filtred.loc[data_filtred['delay_at_checkout_in_minutes'] <= data_filtred['time_delta_with_previous_rental_in_minutes'] + delay])
-
-        total_problematic_rentals = len(data_filtred)
-        
-        percentage_connect = (count_connect / total_problematic_rentals) * 100
-        percentage_mobile = (count_mobile / total_problematic_rentals) * 100
-        percentage_total = (count_total / total_problematic_rentals) * 100
-
-        prct_connect.append(percentage_connect)
-        prct_mobile.append(percentage_mobile)
-        prct_total.append(percentage_total)
+    _, prct_avoided = compute_minimal_delay_effects(tuple(additional_delay_between_rentals_in_minutes))
+    prct_connect = prct_avoided['connect']
+    prct_mobile = prct_avoided['mobile']
+    prct_total = prct_avoided['total']
 
     fig = go.Figure()
 
@@ -237,7 +262,7 @@ with col2 :
             title_font=dict(size=14))
     )
 
-    st.plotly_chart(fig, use_container_width=False)
+    plot_chart(fig, 'Figure #5', use_container_width=False)
 
 col1._lock.width = col1_width
 col2._lock.width = col2_width
@@ -245,46 +270,19 @@ col2._lock.width = col2_width
 #Figure #6
 additional_delay_between_rentals_in_minutes = [5, 15, 30, 60, 90, 120]
 categories = ['connect', 'mobile', 'all']
-data_filtred_pbtics = data.loc[data['delay_at_checkout_in_minutes'] > data['time_delta_with_previous_rental_in_minutes'],:]
 
 bar_width = 2
 opacity = 0.8
 
-prct_connect_avoided = []
-prct_mobile_avoided = []
-prct_total_avoided = []
-prct_connect_affected = []
-prct_mobile_affected = []
-prct_total_affected = []
-
-for delay in minimal_delay_between_rentals_in_minutes:
-    count_connect_avoided = len(data_filtred_pbtics[(data_filtred_pbtics['checkin_type'] == 'connect') & (data_filtred_pbtics['delay_at_checkout_in_minutes'] <= data_filtred['time_delta_with_previous_rental_in_minutes'] + delay)])
-    count_mobile_avoided = len(data_filtred_pbtics[(data_filtred_pbtics['checkin_type'] == 'mobile') & (data_filtred_pbtics['delay_at_checkout_in_minutes'] <= data_filtred['time_delta_with_previous_rental_in_minutes'] + delay)])
-    count_total_avoided = len(data_filtred_pbtics.loc[data_filtred_pbtics['delay_at_checkout_in_minutes'] <= data_filtred_pbtics['time_delta_with_previous_rental_in_minutes'] + delay])
-    count_connect_affected = len(data[(data['checkin_type'] == 'connect') & (data['time_delta_with_previous_rental_in_minutes'] < delay)])
-    count_mobile_affected = len(data[(data['checkin_type'] == 'mobile') & (data['time_delta_with_previous_rental_in_minutes'] < delay)])
-    count_total_affected = len(data[data['time_delta_with_previous_rental_in_minutes'] < delay])
-
-    total_problematic_rentals = len(data_filtred_pbtics)
-    total_connect = len(data[data['checkin_type'] == 'connect'])
-    total_mobile = len(data[data['checkin_type'] == 'mobile'])
-    total = data['time_delta_with_previous_rental_in_minutes'].notna().sum()
-    
-    percentage_connect_avoided = (count_connect_avoided / total_problematic_rentals) * 100
-    percentage_mobile_avoided = (count_mobile_avoided / total_problematic_rentals) * 100
-    percentage_total_avoided = (count_total_avoided / total_problematic_rentals) * 100
-    percentage_connect_affected = (count_connect_affected / total) * 100
-    percentage_mobile_affected = (count_mobile_affected / total) * 100
-    percentage_total_affected = (count_total_affected / total) * 100
-
-    prct_connect_avoided.append(percentage_connect_avoided)
-    prct_mobile_avoided.append(percentage_mobile_avoided)
-    prct_total_avoided.append(percentage_total_avoided)
-    prct_connect_affected.append(percentage_connect_affected)
-    prct_mobile_affected.append(percentage_mobile_affected)
-    prct_total_affected.append(percentage_total_affected)
-    
-    fig = go.Figure()
+prct_affected, prct_avoided = compute_minimal_delay_effects(tuple(minimal_delay_between_rentals_in_minutes))
+prct_connect_avoided = prct_avoided['connect']
+prct_mobile_avoided = prct_avoided['mobile']
+prct_total_avoided = prct_avoided['total']
+prct_connect_affected = prct_affected['connect']
+prct_mobile_affected = prct_affected['mobile']
+prct_total_affected = prct_affected['total']
+
+fig = go.Figure()
 
 fig.add_trace(go.Scatter(
     x=minimal_delay_between_rentals_in_minutes,
@@ -356,6 +354,14 @@ fig.update_layout(
 
 fig_height = 500
 
-st.plotly_chart(fig, use_container_width=True)
+plot_chart(fig, 'Figure #6', use_container_width=True)
+
+fig_style = f"display: block; margin: 0 auto; max-height: {fig_height}px;"
 
-fig_style = f"display: block; margin: 0 auto; max-height: {fig_height}px;"
\ No newline at end of file
+# Payload size per figure
+if show_payload_sizes:
+    st.sidebar.subheader("Figures payload size")
+    st.sidebar.table(pd.DataFrame({
+        'Figure': list(payload_sizes.keys()),
+        'Size (kB)': [round(size / 1024, 1) for size in payload_sizes.values()]
+    }))
\ No newline at end of file